@@ -6,15 +6,38 @@ nlc35 at georgetown dot edu
 
 import sys
 import re
+import itertools
+import json
+import multiprocessing
 import os
 import queue
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_right
 from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, HTTPServer
 
 # CONSTANTS and GLOBAL VALUES
 
 allowed_algos = ["RR", "SJF", "SJR"]
+# Maps each option to the number of values that follow it on the command line
+allowed_options = {"--no-coalesce": 0, "--schedule-file": 1, "--flight-recorder": 1, "--dump-on-process": 1,
+                   "--dump-window": 2, "--workload-dir": 1, "--quanta": 1, "--fast-forward": 0, "--socket": 1,
+                   "--port": 1, "--workers": 1, "--timeout": 1}
+process_file_pattern = re.compile(r'process-\d+\.txt')
 global_average_burst_time = [0]
 global_burst_count = [0]
+# Only set in the server's workers: the shared numbers of the requests being run and this worker's slot in them
+worker_requests = [None]
+worker_slot = [0]
 
 
 # HELPERS
@@ -24,21 +47,116 @@ def print_states(*states):
         print(state)
 
 
+def reset_global_averages():
+    # The averages carry over between simulations run in the same interpreter so they need clearing first
+    global_average_burst_time[0] = 0
+    global_burst_count[0] = 0
+
+
 # PROGRAM CONTROL
 
 def usage_error():
     print("You have called this program incorrectly!", file=sys.stderr)
-    print("Usage: python <scheduling algorithm> [optional algorithm parameter] [verbose] <process time file n>*",
+    print("Usage: python <scheduling algorithm> [optional algorithm parameter] [verbose] [options] "
+          "<process time file n>*", file=sys.stderr)
+    print("       python <scheduling algorithm> [optional algorithm parameter] [verbose] [options] "
+          "--workload-dir <directory>", file=sys.stderr)
+    print("       python compare [--quanta <q1,q2,...>] [options] <process time file n>*", file=sys.stderr)
+    print("       python serve [--socket <path> | --port <port>] [--workers <count>] [--timeout <seconds>]",
           file=sys.stderr)
+    print("       python query <schedule file> at <time>", file=sys.stderr)
+    print("       python query <schedule file> share <process number> <from time> <to time>", file=sys.stderr)
     print(
         "Allowed scheduling algorithms:\n\tRR - Round Robin\n\tSJR - Shortest Job Remaining\n\tSJF - Shortest Job First",
         file=sys.stderr)
+    print("Options:\n\t--no-coalesce - Print every slice even when the same process runs again right after itself"
+          "\n\t--schedule-file <path> - Also write the schedule to an indexed binary file for `query`"
+          "\n\t--flight-recorder <size> - Keep the last <size> events and dump them on error, SIGUSR1 or a trigger"
+          "\n\t--dump-on-process <process number> - Dump the flight recorder when that process is first seen"
+          "\n\t--dump-window <from time> <to time> - Dump the flight recorder when time first enters the window"
+          "\n\t--workload-dir <directory> - Load every process-N.txt file in the directory"
+          "\n\t--quanta <q1,q2,...> - The RR time quanta that `compare` runs, 1,5,10 by default"
+          "\n\t--fast-forward - Skip over whole cycles once RR or SJF settles into a repeating pattern"
+          "\n\t--socket <path> - The Unix socket that `serve` listens on"
+          "\n\t--port <port> - The local port that `serve` listens on when no socket is given, 8000 by default"
+          "\n\t--workers <count> - The number of warm worker processes `serve` keeps, one per CPU by default"
+          "\n\t--timeout <seconds> - How long `serve` lets a simulation run before giving up on it, 60 by default",
+          file=sys.stderr)
     exit(1)
 
 
+def parse_options(arguments):
+    # Pulls the `--option [value]` arguments out from anywhere in the argument list
+    # Returns the options that were given along with the arguments that are left over
+    options = {}
+    remaining_arguments = []
+    current_arg_num = 0
+    while current_arg_num < len(arguments):
+        argument = arguments[current_arg_num]
+        current_arg_num += 1
+        if not argument.startswith("--"):
+            remaining_arguments.append(argument)
+            continue
+        if argument not in allowed_options:
+            print("Unknown option " + argument, file=sys.stderr)
+            usage_error()
+        value_count = allowed_options[argument]
+        values = arguments[current_arg_num:current_arg_num + value_count]
+        if len(values) != value_count:
+            print("The option " + argument + " requires a value", file=sys.stderr)
+            usage_error()
+        current_arg_num += value_count
+        if value_count == 0:
+            options[argument] = True
+        elif value_count == 1:
+            options[argument] = values[0]
+        else:
+            options[argument] = values
+    return options, remaining_arguments
+
+
+def query(arguments):
+    # Answers questions about a schedule file written with --schedule-file
+    try:
+        schedule_file = ScheduleFile(arguments[0])
+    except IndexError:
+        usage_error()
+    except (OSError, ValueError) as e:
+        print("The schedule file could not be read: " + str(e), file=sys.stderr)
+        exit(1)
+    with schedule_file:
+        try:
+            if arguments[1] == "at" and len(arguments) == 3:
+                at_time = int(arguments[2])
+                run = schedule_file.running_at(at_time)
+                if run is None:
+                    print("Nothing ran at time " + str(at_time))
+                else:
+                    print(run[0] + " " + str(run[1]) + " " + str(run[2]))
+            elif arguments[1] == "share" and len(arguments) == 5:
+                print(schedule_file.cpu_share(arguments[2], int(arguments[3]), int(arguments[4])))
+            else:
+                usage_error()
+        except IndexError:
+            usage_error()
+        except ValueError as e:
+            print(str(e), file=sys.stderr)
+            usage_error()
+
+
 def main():
     # Strip off the program name since we don't care about that
     arguments = sys.argv[1:]
+    if len(arguments) > 0 and arguments[0] == "query":
+        query(arguments[1:])
+        return
+    if len(arguments) > 0 and arguments[0] == "compare":
+        compare(arguments[1:])
+        return
+    if len(arguments) > 0 and arguments[0] == "serve":
+        serve(arguments[1:])
+        return
+    options, arguments = parse_options(arguments)
     try:
         current_arg_num = 0
         algorithm = arguments[current_arg_num]
@@ -48,14 +166,14 @@ def main():
         if algorithm == "RR":
             time_quantum = int(arguments[current_arg_num])
             current_arg_num += 1
-        if arguments[current_arg_num] == "verbose":
+        if current_arg_num < len(arguments) and arguments[current_arg_num] == "verbose":
             verbose = True
             current_arg_num += 1
             process_files = arguments[current_arg_num:]
         else:
             verbose = False
             process_files = arguments[current_arg_num:]
-        if len(process_files) == 0:
+        if len(process_files) == 0 and "--workload-dir" not in options:
             print("You must specify at least one process file", file=sys.stderr)
             exit(1)
     except IndexError:
@@ -67,28 +185,615 @@ def main():
         print("An error has occurred. The likely cause is below.", file=sys.stderr)
         usage_error()
     # We have parsed the arguments without error
+    fast_forward = "--fast-forward" in options
+    if fast_forward and algorithm == "SJR":
+        print("Fast forwarding is only supported by RR and SJF", file=sys.stderr)
+        usage_error()
+    processes = load_processes(process_files, options)
+    writers = [ScheduleTextWriter()]
+    if "--schedule-file" in options:
+        writers.append(ScheduleFileWriter(options["--schedule-file"]))
+    # Verbose output has to line up with the runs as they happen so nothing can be held back to grow
+    schedule = ScheduleLog(writers, coalesce="--no-coalesce" not in options and not verbose)
+    recorder = create_flight_recorder(options)
+    try:
+        if algorithm == "RR":
+            round_robin(processes, time_quantum, verbose, schedule, recorder, fast_forward)
+        elif algorithm == "SJF":
+            shortest_job_first(processes, verbose, schedule, recorder, fast_forward)
+        elif algorithm == "SJR":
+            shortest_job_remaining(processes, verbose, schedule, recorder)
+        else:
+            # We have somehow reached an error state
+            print("An error has occurred. The likely cause is below.", file=sys.stderr)
+            usage_error()
+    except Exception:
+        if recorder is not None:
+            recorder.dump("error")
+        raise
+
+
+def load_processes(process_files, options):
     processes = [Process(process_file) for process_file in process_files]
+    if "--workload-dir" in options:
+        processes += load_workload_dir(options["--workload-dir"])
     # Check to make sure that none of the processes start out blocked since that would be an error
     for process in processes:
         if process.state_queue.peek()[0] == "I":
             print("Process " + str(process.process_number) + " starts in a blocked state which is nonsensical!")
             exit(1)
+    # The metrics and the shared workload are keyed by process number so every process needs its own
+    process_files_by_number = {}
+    for process in processes:
+        process_number = int(process.process_number)
+        if process_number in process_files_by_number:
+            print("Process " + str(process_number) + " is loaded from both \"" +
+                  process_files_by_number[process_number] + "\" and \"" + process.process_file + "\"", file=sys.stderr)
+            exit(1)
+        process_files_by_number[process_number] = process.process_file
+    return processes
+
+
+def compare(arguments):
+    # Runs every algorithm, and RR with each of the quanta, over the same workload and reports their metrics together
+    options, process_files = parse_options(arguments)
+    if len(process_files) == 0 and "--workload-dir" not in options:
+        print("You must specify at least one process file", file=sys.stderr)
+        usage_error()
+    try:
+        time_quanta = [int(time_quantum) for time_quantum in options.get("--quanta", "1,5,10").split(",")]
+        if min(time_quanta) <= 0:
+            raise ValueError()
+    except ValueError:
+        print("The time quanta must be a comma separated list of positive integers", file=sys.stderr)
+        usage_error()
+    processes = load_processes(process_files, options)
+    runs = [("RR", time_quantum) for time_quantum in time_quanta] + [("SJF", None), ("SJR", None)]
+    results = compare_algorithms(processes, runs, "--fast-forward" in options)
+    print_comparison(runs, results)
+    failures = [(algorithm, time_quantum, result) for (algorithm, time_quantum), result in zip(runs, results)
+                if not isinstance(result, dict)]
+    for algorithm, time_quantum, error in failures:
+        name = algorithm if time_quantum is None else algorithm + " " + str(time_quantum)
+        print(name + " failed: " + repr(error), file=sys.stderr)
+    if failures:
+        exit(1)
+
+
+def serve(arguments):
+    # Keeps a pool of worker processes warm and runs simulations for requests sent over HTTP
+    options, arguments = parse_options(arguments)
+    if len(arguments) != 0 or ("--socket" in options and "--port" in options):
+        usage_error()
+    try:
+        port = int(options.get("--port", 8000))
+        worker_count = int(options.get("--workers", multiprocessing.cpu_count()))
+        timeout = float(options.get("--timeout", 60))
+        if worker_count <= 0 or not timeout > 0:
+            raise ValueError()
+    except ValueError:
+        print("The port and worker count must be positive integers and the timeout a positive number of seconds",
+              file=sys.stderr)
+        usage_error()
+    socket_path = options.get("--socket")
+    if socket_path is not None and os.path.exists(socket_path):
+        if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            print("\"" + socket_path + "\" already exists and is not a socket", file=sys.stderr)
+            exit(1)
+        # Only remove it when nothing is listening, otherwise it belongs to a server that is still running
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except ConnectionRefusedError:
+            # Left behind by a server that didn't shut down cleanly
+            os.unlink(socket_path)
+        else:
+            print("\"" + socket_path + "\" is already in use by another server", file=sys.stderr)
+            exit(1)
+        finally:
+            probe.close()
+    workers = WorkerPool(worker_count, timeout)
+    try:
+        if socket_path is not None:
+            server = UnixSimulationServer(socket_path, SimulationRequestHandler)
+            print("Listening on " + socket_path, file=sys.stderr)
+        else:
+            # Only listen locally since there is no authentication
+            server = TCPSimulationServer(("127.0.0.1", port), SimulationRequestHandler)
+            print("Listening on http://127.0.0.1:" + str(server.server_address[1]), file=sys.stderr)
+        server.workers = workers
+        server.stats = ServerStats()
+        # Shut down cleanly when stopped by a service manager as well as by Ctrl-C
+        signal.signal(signal.SIGTERM, lambda signal_number, frame: exit(0))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if socket_path is not None:
+                os.unlink(socket_path)
+    finally:
+        workers.close()
+
+
+def create_flight_recorder(options):
+    # Builds the flight recorder asked for by the options, or returns None when it wasn't asked for
+    if "--flight-recorder" not in options:
+        if "--dump-on-process" in options or "--dump-window" in options:
+            print("Dump triggers need --flight-recorder to be set", file=sys.stderr)
+            usage_error()
+        return None
+    try:
+        size = int(options["--flight-recorder"])
+        if size <= 0:
+            raise ValueError()
+        triggers = []
+        if "--dump-on-process" in options:
+            triggers.append(process_trigger(int(options["--dump-on-process"])))
+        if "--dump-window" in options:
+            from_time, to_time = options["--dump-window"]
+            triggers.append(time_window_trigger(int(from_time), int(to_time)))
+    except ValueError:
+        print("The flight recorder size, process number and window times must be integers", file=sys.stderr)
+        usage_error()
+    recorder = FlightRecorder(size, triggers)
+    # Allow a dump to be requested from outside while the simulation is running
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signal_number, frame: recorder.dump("requested"))
+    return recorder
+
+
+# WORKLOAD LOADING
+
+def load_workload_dir(directory):
+    # Loads every process file in the directory concurrently since startup is dominated by file I/O
+    # Any files that can't be loaded are all reported together before exiting
+    try:
+        entries = list(os.scandir(directory))
+    except OSError as e:
+        print("The workload directory \"" + directory + "\" could not be read: " + str(e), file=sys.stderr)
+        exit(1)
+    process_files = [entry.path for entry in entries if process_file_pattern.fullmatch(entry.name) and entry.is_file()]
+    if len(process_files) == 0:
+        print("The workload directory \"" + directory + "\" does not contain any process files", file=sys.stderr)
+        exit(1)
+    # Keep the order stable between runs since the directory order isn't
+    process_files.sort(key=lambda process_file: int(re.search(r'\d+', os.path.basename(process_file)).group()))
+    # Files are handed to the threads in batches since one task per file costs more than parsing the file
+    batch_size = max(1, len(process_files) // (4 * (os.cpu_count() or 1)))
+    batches = [process_files[i:i + batch_size] for i in range(0, len(process_files), batch_size)]
+    processes = []
+    errors = []
+    with ThreadPoolExecutor() as executor:
+        for batch_processes, batch_errors in executor.map(load_process_files, batches):
+            processes += batch_processes
+            errors += batch_errors
+    if errors:
+        print(str(len(errors)) + " process file(s) could not be loaded:", file=sys.stderr)
+        for error in errors:
+            print("\t" + error, file=sys.stderr)
+        exit(1)
+    return processes
+
+
+def load_process_files(process_files):
+    # Returns the processes that loaded and an error message for each file that didn't
+    processes = []
+    errors = []
+    for process_file in process_files:
+        try:
+            processes.append(load_process_file(process_file))
+        except (OSError, UnicodeDecodeError, ValueError) as e:
+            errors.append("\"" + process_file + "\": " + str(e))
+    return processes, errors
+
+
+def load_process_file(process_file):
+    with open(process_file, 'r') as f:
+        start, states = parse_process_text(f.read())
+    if states[0][0] == "I":
+        raise ValueError("the process starts in a blocked state which is nonsensical")
+    return Process(process_file, start, states)
+
+
+def parse_process_text(text):
+    # Returns the start time and the list of states in a process file
+    # Each line is a keyword and a time, anything after those is ignored, and the start line can go anywhere
+    start = None
+    states = []
+    for line in text.split("\n"):
+        line_parts = line.split()
+        if len(line_parts) == 0 or line_parts[0] == "end":
+            continue
+        if len(line_parts) == 1:
+            raise ValueError("the line \"" + line.strip() + "\" is missing its time")
+        if line_parts[0] == "start":
+            start = int(line_parts[1])
+        else:
+            states.append((line_parts[0], int(line_parts[1])))
+    if start is None:
+        raise ValueError("the process file has no start time")
+    if len(states) == 0:
+        raise ValueError("the process file is empty")
+    return start, states
+
+
+# ALGORITHM COMPARISON
+
+def compare_algorithms(processes, runs, fast_forward=False):
+    # Each run happens in its own worker process and reads the workload straight out of shared memory
+    # The workers build their own processes from it so no run can consume the state of another
+    from multiprocessing import shared_memory
+    workload = pack_workload(processes)
+    shared_workload = shared_memory.SharedMemory(create=True, size=len(workload) * workload.itemsize)
+    try:
+        shared_workload.buf[:len(workload) * workload.itemsize] = workload.tobytes()
+        with ProcessPoolExecutor(max_workers=min(len(runs), multiprocessing.cpu_count())) as executor:
+            futures = [executor.submit(run_shared_workload, shared_workload.name, algorithm, time_quantum, fast_forward)
+                       for algorithm, time_quantum in runs]
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    # A run that fails is reported in its own column rather than losing the whole comparison
+                    results.append(e)
+            return results
+    finally:
+        shared_workload.close()
+        shared_workload.unlink()
+
+
+def pack_workload(processes):
+    # Flattens the workload into 64 bit integers: the number of processes, the offset of each process and then
+    # for every process its number, start time, state count and a (0 for bursts, 1 for IO, time) pair per state
+    workload = array("q", [len(processes)] + [0] * len(processes))
+    for i, process in enumerate(processes):
+        workload[i + 1] = len(workload)
+        workload.extend((int(process.process_number), process.start, len(process.state_queue)))
+        for kind, state_time in process.state_queue:
+            workload.extend((0 if kind == "B" else 1, state_time))
+    return workload
+
+
+def unpack_workload(buffer):
+    # Builds fresh processes from a packed workload, reading the buffer in place
+    workload = buffer.cast("q")
+    try:
+        processes = []
+        for i in range(workload[0]):
+            offset = workload[i + 1]
+            process_number, start, state_count = workload[offset:offset + 3]
+            times = workload[offset + 4:offset + 4 + 2 * state_count:2]
+            kinds = ["B" if kind == 0 else "I" for kind in workload[offset + 3:offset + 3 + 2 * state_count:2]]
+            processes.append(Process("process-" + str(process_number) + ".txt", start, zip(kinds, times)))
+        return processes
+    finally:
+        workload.release()
+
+
+def run_shared_workload(shared_name, algorithm, time_quantum=None, fast_forward=False):
+    # Runs in a worker process and returns the metrics of the schedule the algorithm produced
+    from multiprocessing import shared_memory
+    shared_workload = shared_memory.SharedMemory(name=shared_name)
+    try:
+        processes = unpack_workload(shared_workload.buf)
+    finally:
+        shared_workload.close()
+    metrics = ScheduleMetrics(processes)
+    simulate(processes, algorithm, time_quantum, ScheduleLog([metrics]), fast_forward)
+    return metrics.summary()
+
+
+def simulate(processes, algorithm, time_quantum, schedule, fast_forward=False):
+    # Runs the algorithm quietly, for workers that may already have run other simulations
+    reset_global_averages()
     if algorithm == "RR":
-        round_robin(processes, time_quantum, verbose)
+        round_robin(processes, time_quantum, schedule=schedule, fast_forward=fast_forward)
     elif algorithm == "SJF":
-        shortest_job_first(processes, verbose)
-    elif algorithm == "SJR":
-        shortest_job_remaining(processes, verbose)
+        shortest_job_first(processes, schedule=schedule, fast_forward=fast_forward)
     else:
-        # We have somehow reached an error state
-        print("An error has occurred. The likely cause is below.", file=sys.stderr)
-        usage_error()
+        shortest_job_remaining(processes, schedule=schedule)
+
+
+def print_comparison(runs, results):
+    names = [algorithm if time_quantum is None else algorithm + " " + str(time_quantum)
+             for algorithm, time_quantum in runs]
+    rows = [("Makespan", "makespan"), ("CPU utilization", "cpu_utilization"), ("Idle time", "idle_time"),
+            ("Dispatches", "dispatches"), ("Average turnaround", "average_turnaround"),
+            ("Maximum turnaround", "maximum_turnaround"), ("Average waiting", "average_waiting"),
+            ("Average response", "average_response")]
+    table = [[""] + names]
+    for label, key in rows:
+        table.append([label] + [format_metric(result[key]) if isinstance(result, dict) else "failed"
+                                for result in results])
+    widths = [max(len(row[column]) for row in table) for column in range(len(table[0]))]
+    for row in table:
+        print("  ".join(cell.ljust(width) if column == 0 else cell.rjust(width)
+                        for column, (cell, width) in enumerate(zip(row, widths))).rstrip())
+
+
+def format_metric(value):
+    if isinstance(value, float):
+        return "{:.2f}".format(value)
+    return str(value)
+
+
+# SIMULATION SERVER
+
+class TCPSimulationServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class UnixSimulationServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ServerStats:
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        # Requests that are waiting for or running on a worker
+        self.queue_depth = 0
+        self.request_count = 0
+        self.error_count = 0
+        # Latencies of the most recent requests in seconds
+        self.latencies = deque(maxlen=window)
+
+    def started(self):
+        with self.lock:
+            self.queue_depth += 1
+
+    def finished(self, latency, succeeded):
+        with self.lock:
+            self.queue_depth -= 1
+            self.request_count += 1
+            if not succeeded:
+                self.error_count += 1
+            self.latencies.append(latency)
+
+    def snapshot(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            return {
+                "queue_depth": self.queue_depth,
+                "requests": self.request_count,
+                "errors": self.error_count,
+                "latency_p50_ms": percentile(latencies, 50) * 1000,
+                "latency_p99_ms": percentile(latencies, 99) * 1000,
+            }
+
+
+def percentile(sorted_values, percent):
+    if len(sorted_values) == 0:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, len(sorted_values) * percent // 100)]
+
+
+class SimulationRequestHandler(BaseHTTPRequestHandler):
+    # POST /simulate runs a workload and GET /stats reports how the server is doing
+
+    def do_GET(self):
+        if self.path != "/stats":
+            self.send_json(404, {"error": "Unknown path " + self.path})
+            return
+        self.send_json(200, self.server.stats.snapshot())
+
+    def do_POST(self):
+        if self.path != "/simulate":
+            self.send_json(404, {"error": "Unknown path " + self.path})
+            return
+        started_at = time.monotonic()
+        self.server.stats.started()
+        succeeded = False
+        try:
+            try:
+                length = int(self.headers.get("Content-Length", ""))
+                if length < 0:
+                    raise ValueError()
+                request = json.loads(self.rfile.read(length).decode("utf-8"))
+            except (ValueError, UnicodeDecodeError, RecursionError):
+                self.send_json(400, {"error": "The request body must be JSON with a Content-Length"})
+                return
+            try:
+                result = self.server.workers.run(simulate_request, request)
+            except ValueError as e:
+                self.send_json(400, {"error": str(e)})
+                return
+            except FutureTimeoutError:
+                self.send_json(504, {"error": "The simulation took longer than " + str(self.server.workers.timeout) +
+                                              " seconds"})
+                return
+            except BrokenProcessPool:
+                self.send_json(500, {"error": "The worker running the simulation died"})
+                return
+            except Exception as e:
+                self.send_json(500, {"error": "The simulation failed: " + repr(e)})
+                return
+            self.send_json(200, result)
+            succeeded = True
+        finally:
+            self.server.stats.finished(time.monotonic() - started_at, succeeded)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # Unix socket clients don't have an address
+        return str(self.client_address[0]) if self.client_address else "local"
+
+    def log_message(self, format, *args):
+        # Logging every request would cost more than small simulations do
+        pass
+
+
+class WorkerPool:
+    # The warm worker processes that the server runs simulations on
+    # The pool is replaced when a worker dies, which otherwise breaks it for good, or when a simulation times out
+    # Either way every worker in the old pool goes, so the other simulations they were running have to start again
+
+    def __init__(self, worker_count, timeout=None):
+        self.worker_count = worker_count
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.request_numbers = itertools.count(1)
+        # The executor, the request each of its workers is running and whether it was stopped for a timeout
+        self.pool = self.start()
+
+    def start(self):
+        # Without a lock since a worker killed while holding it would leave the server waiting on it forever
+        running_requests = multiprocessing.Array("q", self.worker_count, lock=False)
+        next_slot = multiprocessing.Value("i", 0)
+        executor = ProcessPoolExecutor(max_workers=self.worker_count, initializer=start_worker,
+                                       initargs=(running_requests, next_slot))
+        # Start every worker now so the first requests don't pay for it
+        for future in [executor.submit(warm_up) for _ in range(self.worker_count)]:
+            future.result()
+        return executor, running_requests, threading.Event()
+
+    def replace(self, pool, timed_out=False):
+        # Only the first request to find the pool broken replaces it, the rest just use the new one
+        with self.lock:
+            if self.pool is pool:
+                if timed_out:
+                    pool[2].set()
+                self.pool = self.start()
+                stop_workers(pool[0])
+
+    def run(self, function, *arguments):
+        for attempt in range(2):
+            pool = self.pool
+            executor, running_requests, timed_out = pool
+            request_number = next(self.request_numbers)
+            try:
+                return executor.submit(run_in_worker, request_number, function, *arguments).result(self.timeout)
+            except BrokenProcessPool:
+                self.replace(pool)
+                # A request that was running when its worker died may well be what killed it, so it is only tried
+                # again if it never reached a worker or the pool was stopped because another request timed out
+                if attempt == 1 or (request_number in running_requests[:] and not timed_out.is_set()):
+                    raise
+            except FutureTimeoutError:
+                # The worker would carry on running the simulation so it goes along with the rest of the pool
+                self.replace(pool, timed_out=True)
+                raise
+
+    def close(self):
+        with self.lock:
+            stop_workers(self.pool[0])
+
+
+def stop_workers(executor):
+    # Shutting the pool down leaves running simulations to finish so the workers are killed as well
+    # ProcessPoolExecutor only has a public way of doing that from python 3.14
+    worker_processes = list((executor._processes or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for worker_process in worker_processes:
+        worker_process.terminate()
+    for worker_process in worker_processes:
+        worker_process.join()
+
+
+def start_worker(running_requests, next_slot):
+    # Runs once in each new worker to give it a slot for the number of the request it is running
+    with next_slot.get_lock():
+        worker_slot[0] = next_slot.value
+        next_slot.value += 1
+    worker_requests[0] = running_requests
+
+
+def run_in_worker(request_number, function, *arguments):
+    # The slot is left set if the worker dies so the server can tell which request was running on it
+    worker_requests[0][worker_slot[0]] = request_number
+    try:
+        return function(*arguments)
+    finally:
+        worker_requests[0][worker_slot[0]] = 0
+
+
+def warm_up():
+    return os.getpid()
+
+
+def simulate_request(request):
+    # Runs in a worker process. The request looks like
+    # {"algorithm": "RR", "quantum": 5, "coalesce": true, "fast_forward": false,
+    #  "processes": [{"number": 1, "start": 0, "states": [["B", 5], ["I", 2], ["B", 3]]},
+    #                {"number": 2, "text": "start 4\nB 10\nend"}]}
+    # and the schedule comes back as [process number or "Idle", start, end] runs along with the metrics
+    if not isinstance(request, dict):
+        raise ValueError("The request must be a JSON object")
+    algorithm = request.get("algorithm")
+    if algorithm not in allowed_algos:
+        raise ValueError("The algorithm must be one of " + ", ".join(allowed_algos))
+    time_quantum = request.get("quantum")
+    if algorithm == "RR" and (not is_integer(time_quantum) or time_quantum <= 0):
+        raise ValueError("RR needs a positive integer quantum")
+    fast_forward = bool(request.get("fast_forward", False))
+    if fast_forward and algorithm == "SJR":
+        raise ValueError("Fast forwarding is only supported by RR and SJF")
+    if not isinstance(request.get("processes"), list) or len(request["processes"]) == 0:
+        raise ValueError("The request must have a list of processes")
+    processes = [process_from_request(process_request) for process_request in request["processes"]]
+    # The metrics are kept by process number so every process needs its own
+    if len(set(int(process.process_number) for process in processes)) != len(processes):
+        raise ValueError("Every process needs a different number")
+    runs = ScheduleRuns()
+    metrics = ScheduleMetrics(processes)
+    schedule = ScheduleLog([runs, metrics], coalesce=bool(request.get("coalesce", True)))
+    simulate(processes, algorithm, time_quantum, schedule, fast_forward)
+    return {"schedule": runs.runs, "metrics": metrics.summary()}
+
+
+def is_integer(value):
+    # JSON true and false come through as bools, which python also counts as ints
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def process_from_request(process_request):
+    if not isinstance(process_request, dict) or not is_integer(process_request.get("number")) or \
+            process_request["number"] < 0:
+        raise ValueError("Every process needs a non-negative integer number")
+    number = process_request["number"]
+    try:
+        if "text" in process_request:
+            if not isinstance(process_request["text"], str):
+                raise TypeError("the text must be a string")
+            start, states = parse_process_text(process_request["text"])
+        else:
+            start = process_request["start"]
+            states = [tuple(state) for state in process_request["states"]]
+            if not is_integer(start) or any(len(state) != 2 or not is_integer(state[1]) for state in states):
+                raise TypeError("the start and every state time must be integers")
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError("Process " + str(number) + " could not be read: " + str(e))
+    if len(states) == 0:
+        raise ValueError("Process " + str(number) + " is empty")
+    if any(kind not in ("B", "I") for kind, state_time in states):
+        raise ValueError("Process " + str(number) + " has a state that isn't B (a burst) or I (IO)")
+    if start < 0 or any(state_time < 0 for kind, state_time in states):
+        raise ValueError("Process " + str(number) + " has a negative start or state time")
+    if states[0][0] == "I":
+        raise ValueError("Process " + str(number) + " starts in a blocked state which is nonsensical")
+    return Process("process-" + str(number) + ".txt", start, states)
 
 
 # ALGORITHMS
 
 
-def round_robin(processes, time_quantum, verbose=False):
+def round_robin(processes, time_quantum, verbose=False, schedule=None, recorder=None, fast_forward=False):
+    if schedule is None:
+        schedule = ScheduleLog()
+    cycle_detector = None
+    if fast_forward:
+        # Runs go through the detector so that it can replay them when it skips ahead
+        cycle_detector = CycleDetector(processes, schedule)
+        schedule = cycle_detector
     # Push all of the processes into the start queue where they will wait until they're started
     start_queue = ProcessQueue()
     for process in processes:
@@ -98,6 +803,9 @@ def round_robin(processes, time_quantum, verbose=False):
     start_queue = ProcessQueue(sorted(start_queue, key=lambda x: x[0]))
     process_queue = ProcessQueue()
     current_time = 0
+    if recorder:
+        recorder.watch_queue("Start queue", start_queue)
+        recorder.watch_queue("Process queue", process_queue)
 
     if verbose:
         print("Time 0: Waiting for first process to arrive")
@@ -105,7 +813,10 @@ def round_robin(processes, time_quantum, verbose=False):
     # Pull the first items out of the start queue
     while process_queue.empty:
         while start_queue.not_empty and start_queue.peek()[1].start == current_time:
-            process_queue.push_back(start_queue.pop_front())
+            arrival = start_queue.pop_front()
+            process_queue.push_back(arrival)
+            if recorder:
+                recorder.record(current_time, "arrived", arrival[1].process_number)
         if process_queue.empty:
             current_time += 1
 
@@ -113,12 +824,31 @@ def round_robin(processes, time_quantum, verbose=False):
         print("Time " + str(current_time) + ": Process(es) have arrived")
         print("Current process queue: " + process_queue.single_line_string())
     if current_time != 0:
-        print("Idle 0 " + str(current_time))
+        schedule.idle(0, current_time)
+        if recorder:
+            recorder.record(0, "idle", None, current_time)
 
     # Begin RR loop
     blocked_count = 0  # Number of processes in a row that have been blocked
+    recorded_waits = {}  # The wait each process was last recorded as blocked on
     last_execution_time = current_time
     while process_queue.not_empty or start_queue.not_empty:
+        if cycle_detector and start_queue.empty and cycle_detector.due():
+            # Everything that affects what happens next, with times made relative to now
+            signature = (current_time - last_execution_time, blocked_count,
+                         tuple((process, current_time - waiting_since, process.state_queue[0])
+                               for waiting_since, process in process_queue))
+            skipped_time = cycle_detector.check(current_time, signature)
+            if skipped_time:
+                current_time += skipped_time
+                last_execution_time += skipped_time
+                for i in range(len(process_queue)):
+                    waiting_since, process = process_queue[i]
+                    process_queue[i] = (waiting_since + skipped_time, process)
+                if verbose:
+                    print("Time " + str(current_time) + ": Fast forwarded " + str(skipped_time) + " time units")
+                if recorder:
+                    recorder.record(current_time, "fast-forwarded", None, skipped_time)
         # See if we need to load something from the start queue
         if verbose:
             print("Time " + str(current_time) + ": Checking if process needs to be loaded from start queue...", end="")
@@ -131,7 +861,10 @@ def round_robin(processes, time_quantum, verbose=False):
             # Pull the first items out of the start queue
             while process_queue.empty:
                 while start_queue.not_empty and start_queue.peek()[1].start == current_time:
-                    process_queue.push_back(start_queue.pop_front())
+                    arrival = start_queue.pop_front()
+                    process_queue.push_back(arrival)
+                    if recorder:
+                        recorder.record(current_time, "arrived", arrival[1].process_number)
                 if process_queue.empty:
                     current_time += 1
 
@@ -148,27 +881,34 @@ def round_robin(processes, time_quantum, verbose=False):
             blocked_count = 0
             # Check to see if we were idle for any period of time leading up to this
             if current_time - last_execution_time > 0:
-                print("Idle " + str(last_execution_time) + " " + str(current_time))
+                schedule.idle(last_execution_time, current_time)
+                if recorder:
+                    recorder.record(last_execution_time, "idle", None, current_time)
             # We are in the middle of a burst
             if process_state[1] > time_quantum:
                 process.state_queue.push_front(("B", process_state[1] - time_quantum))
                 current_time += time_quantum
-                print(str(process.process_number) + " " + str(start_time) + " " + str(current_time))
+                schedule.run(process.process_number, start_time, current_time)
             elif process_state[1] == time_quantum:
                 current_time += time_quantum
-                print(str(process.process_number) + " " + str(start_time) + " " + str(current_time))
+                schedule.run(process.process_number, start_time, current_time)
             else:
                 # The whole burst isn't needed
                 current_time += process_state[1]
-                print(str(process.process_number) + " " + str(start_time) + " " + str(current_time))
+                schedule.run(process.process_number, start_time, current_time)
             last_execution_time = current_time
             # If the process has more work to do put it back into the queue
             if process.state_queue.not_empty:
                 process_queue.push_back((current_time, process))
+                if recorder:
+                    recorder.record(start_time, "ran", process.process_number, current_time)
             else:
                 # The process has finished
                 if verbose:
                     print("Time " + str(current_time) + ": " + str(process) + " finished")
+                if recorder:
+                    recorder.record(start_time, "ran", process.process_number, current_time)
+                    recorder.record(current_time, "finished", process.process_number)
         else:
             # First check to see if it has waited long enough to no longer be blocked
             if verbose:
@@ -179,16 +919,22 @@ def round_robin(processes, time_quantum, verbose=False):
                 blocked_count = 0
                 if verbose:
                     print("unblocked")
+                if recorder:
+                    recorder.record(current_time, "unblocked", process.process_number)
             elif current_time - waiting_since == process_state[1] and len(process.state_queue) > 0:
                 # It is just this moment becoming unblocked, put it at the back of the queue
                 process_queue.push_back((current_time, process))
                 blocked_count = 0
                 if verbose:
                     print("unblocked")
+                if recorder:
+                    recorder.record(current_time, "unblocked", process.process_number)
             elif current_time - waiting_since >= process_state[1] and len(process.state_queue) == 0:
                 # The process finished on an IO request and do nothing
                 if verbose:
                     print("unblocked and process finished")
+                if recorder:
+                    recorder.record(current_time, "finished", process.process_number)
             else:
                 # It hasn't waited long enough and yields its turn
                 if verbose:
@@ -196,6 +942,11 @@ def round_robin(processes, time_quantum, verbose=False):
                 # Put this state back into its state queue
                 process.state_queue.push_front(process_state)
                 process_queue.push_back((waiting_since, process))
+                if recorder and recorded_waits.get(process) != waiting_since:
+                    # Only the first time round for each wait so the buffer isn't filled by the same process ticking down
+                    recorded_waits[process] = waiting_since
+                    recorder.record(current_time, "blocked", process.process_number,
+                                    process_state[1] - (current_time - waiting_since))
                 blocked_count += 1
                 if blocked_count >= len(process_queue):
                     # All processes are blocked
@@ -208,8 +959,11 @@ def round_robin(processes, time_quantum, verbose=False):
                       end="")
             new_procs = False
             while start_queue.not_empty and start_queue.peek()[1].start <= current_time:
-                process_queue.push_back(start_queue.pop_front())
+                arrival = start_queue.pop_front()
+                process_queue.push_back(arrival)
                 new_procs = True
+                if recorder:
+                    recorder.record(current_time, "arrived", arrival[1].process_number)
             if verbose:
                 if new_procs:
                     print("yes")
@@ -217,10 +971,17 @@ def round_robin(processes, time_quantum, verbose=False):
                     print("no")
             if verbose:
                 print("Time " + str(current_time) + ": Current process queue: " + process_queue.single_line_string())
-    print("end")
+    schedule.close()
 
 
-def shortest_job_first(processes, verbose=False):
+def shortest_job_first(processes, verbose=False, schedule=None, recorder=None, fast_forward=False):
+    if schedule is None:
+        schedule = ScheduleLog()
+    cycle_detector = None
+    if fast_forward:
+        # Runs go through the detector so that it can replay them when it skips ahead
+        cycle_detector = CycleDetector(processes, schedule)
+        schedule = cycle_detector
     current_time = 0
     # Push all of the processes into the start queue where they will wait until they're started
     start_state = StartPool()
@@ -230,6 +991,8 @@ def shortest_job_first(processes, verbose=False):
     # Create our states used for the actual running of the algorithm
     ready_state = ReadyPool()
     blocked_state = BlockedPool()
+    if recorder:
+        recorder.watch(start_state, ready_state, blocked_state)
 
     if verbose:
         print("Time 0: Waiting for first process to arrive")
@@ -243,16 +1006,36 @@ def shortest_job_first(processes, verbose=False):
             for process in ready_processes:
                 process.start_process()
                 ready_state.add(process)
+                if recorder:
+                    recorder.record(current_time, "arrived", process.process_number)
     if verbose:
         print("Time " + str(current_time) + ": Process(es) have arrived")
         print_states(start_state, ready_state, blocked_state)
 
     if current_time != 0:
-        print("Idle 0 " + str(current_time))
+        schedule.idle(0, current_time)
+        if recorder:
+            recorder.record(0, "idle", None, current_time)
 
     # Begin main loop
     last_execution_time = current_time
     while ready_state.not_empty or blocked_state.not_empty or start_state.not_empty:
+        if cycle_detector and start_state.empty and cycle_detector.due():
+            # Everything that affects what happens next, with times made relative to now
+            # The burst estimates are left out since the detector checks they still pick the same processes
+            signature = (current_time - last_execution_time,
+                         frozenset((process, process.state_queue[0]) for process in ready_state),
+                         tuple((process, process.state_queue[0]) for process in blocked_state.processes))
+            skipped_time = cycle_detector.check(current_time, signature)
+            if skipped_time:
+                current_time += skipped_time
+                last_execution_time += skipped_time
+                # The burst estimates have moved on so the ready processes need filing under their new ones
+                ready_state.refresh()
+                if verbose:
+                    print("Time " + str(current_time) + ": Fast forwarded " + str(skipped_time) + " time units")
+                if recorder:
+                    recorder.record(current_time, "fast-forwarded", None, skipped_time)
         start_time = current_time
         # Let's first see if we have something that we can run
         if verbose:
@@ -260,11 +1043,17 @@ def shortest_job_first(processes, verbose=False):
         if ready_state.not_empty:
             # We can run something
             process = ready_state.get_next_ready_process()
+            if cycle_detector:
+                cycle_detector.picked(process, ready_state)
             if verbose:
                 print("yes. Running " + str(process))
             if last_execution_time != current_time:
-                print("Idle " + str(last_execution_time) + " " + str(current_time))
+                schedule.idle(last_execution_time, current_time)
+                if recorder:
+                    recorder.record(last_execution_time, "idle", None, current_time)
             burst_time = process.run_full_burst()
+            if cycle_detector:
+                cycle_detector.burst_completed(process, burst_time)
             # Update the blocked state to reflect this burst happening
             if verbose:
                 print("Time " + str(current_time) + ": Updating blocked state to reflect completion of burst")
@@ -280,12 +1069,22 @@ def shortest_job_first(processes, verbose=False):
                     ready_state.add(ready_process)
             current_time += burst_time
             last_execution_time = current_time
-            print(str(process.process_number) + " " + str(start_time) + " " + str(current_time))
+            schedule.run(process.process_number, start_time, current_time)
+            if recorder:
+                recorder.record(start_time, "ran", process.process_number, current_time)
+                # The processes that came out of the blocked pool only get back once the burst is over
+                for ready_process in ready_processes:
+                    if ready_process.state_queue.empty:
+                        recorder.record(current_time, "finished", ready_process.process_number)
+                    else:
+                        recorder.record(current_time, "unblocked", ready_process.process_number)
             # Now put the process into the appropriate pool or let it die since it is finished
             if process.state_queue.empty:
                 # The process has finished everything it needs to do
                 if verbose:
                     print("Time " + str(current_time) + ": " + str(process) + " finished")
+                if recorder:
+                    recorder.record(current_time, "finished", process.process_number)
             elif process.state_queue.peek()[0] == "B":
                 # Another burst is queued up for some reason (this is dumb but whatever)
                 if verbose:
@@ -296,6 +1095,8 @@ def shortest_job_first(processes, verbose=False):
                 if verbose:
                     print("Time " + str(current_time) + ": " + str(process) + " moved to blocked state")
                 blocked_state.add(process)
+                if recorder:
+                    recorder.record(current_time, "blocked", process.process_number, process.state_queue.peek()[1])
             if verbose:
                 print("Time " + str(current_time) + ":")
                 print_states(start_state, ready_state, blocked_state)
@@ -316,8 +1117,12 @@ def shortest_job_first(processes, verbose=False):
                 if ready_process.state_queue.empty:
                     if verbose:
                         print("Time " + str(current_time) + ": " + str(ready_process) + " finished")
+                    if recorder:
+                        recorder.record(current_time, "finished", ready_process.process_number)
                 else:
                     ready_state.add(ready_process)
+                    if recorder:
+                        recorder.record(current_time, "unblocked", ready_process.process_number)
             if verbose:
                 print("Time " + str(current_time) + ":")
                 print_states(start_state, ready_state, blocked_state)
@@ -337,13 +1142,17 @@ def shortest_job_first(processes, verbose=False):
                 for process in ready_processes:
                     process.start_process()
                     ready_state.add(process)
+                    if recorder:
+                        recorder.record(current_time, "arrived", process.process_number)
                 if verbose:
                     print("Time " + str(current_time) + ":")
                     print_states(start_state, ready_state, blocked_state)
-    print("end")
+    schedule.close()
 
 
-def shortest_job_remaining(processes, verbose=False):
+def shortest_job_remaining(processes, verbose=False, schedule=None, recorder=None):
+    if schedule is None:
+        schedule = ScheduleLog()
     current_time = 0
     # Push all of the processes into the start queue where they will wait until they're started
     start_state = StartPool()
@@ -353,6 +1162,8 @@ def shortest_job_remaining(processes, verbose=False):
     # Create our states used for the actual running of the algorithm
     ready_state = ReadyPool()
     blocked_state = BlockedPool()
+    if recorder:
+        recorder.watch(start_state, ready_state, blocked_state)
 
     if verbose:
         print("Time 0: Waiting for first process to arrive")
@@ -366,12 +1177,16 @@ def shortest_job_remaining(processes, verbose=False):
             for process in ready_processes:
                 process.start_process()
                 ready_state.add(process)
+                if recorder:
+                    recorder.record(current_time, "arrived", process.process_number)
     if verbose:
         print("Time " + str(current_time) + ": Process(es) have arrived")
         print_states(start_state, ready_state, blocked_state)
 
     if current_time != 0:
-        print("Idle 0 " + str(current_time))
+        schedule.idle(0, current_time)
+        if recorder:
+            recorder.record(0, "idle", None, current_time)
 
     # Begin main loop
     last_execution_time = current_time
@@ -387,7 +1202,9 @@ def shortest_job_remaining(processes, verbose=False):
                 print("yes. Running " + str(process))
             # Check if we were idle and if we were then print that
             if last_execution_time - current_time != 0:
-                print("Idle " + str(last_execution_time) + " " + str(current_time))
+                schedule.idle(last_execution_time, current_time)
+                if recorder:
+                    recorder.record(last_execution_time, "idle", None, current_time)
             # We are going to run this process 1 time step at a time to see if anything better comes along
             changed = False
             while not changed:
@@ -410,7 +1227,16 @@ def shortest_job_remaining(processes, verbose=False):
                         print("yes")
                         print("Time " + str(current_time) + ": Adding " + str(len(ready_processes)) + " to ready state")
                     for ready_process in ready_processes:
-                        ready_state.add(ready_process)
+                        # Processes whose last state was IO are finished rather than ready
+                        if ready_process.state_queue.empty:
+                            if verbose:
+                                print("Time " + str(current_time) + ": " + str(ready_process) + " finished")
+                            if recorder:
+                                recorder.record(current_time, "finished", ready_process.process_number)
+                        else:
+                            ready_state.add(ready_process)
+                            if recorder:
+                                recorder.record(current_time, "unblocked", ready_process.process_number)
                 else:
                     if verbose:
                         print("no")
@@ -425,6 +1251,8 @@ def shortest_job_remaining(processes, verbose=False):
                     for ready_process in ready_processes:
                         ready_process.start_process()
                         ready_state.add(ready_process)
+                        if recorder:
+                            recorder.record(current_time, "arrived", ready_process.process_number)
                 else:
                     if verbose:
                         print("no")
@@ -444,10 +1272,14 @@ def shortest_job_remaining(processes, verbose=False):
                     if verbose:
                         print("yes")
                     process = new_process
-            print(str(process.process_number) + " " + str(start_time) + " " + str(current_time))
+            schedule.run(process.process_number, start_time, current_time)
+            if recorder:
+                recorder.record(start_time, "ran", process.process_number, current_time)
             if process.state_queue.empty:
                 if verbose:
                     print("Time " + str(current_time) + ": " + str(process) + " finished")
+                if recorder:
+                    recorder.record(current_time, "finished", process.process_number)
             else:
                 if process.state_queue.peek()[0] == "B":
                     if verbose:
@@ -457,6 +1289,8 @@ def shortest_job_remaining(processes, verbose=False):
                     if verbose:
                         print("Time " + str(current_time) + ": Moving " + str(process) + " to blocked state")
                     blocked_state.add(process)
+                    if recorder:
+                        recorder.record(current_time, "blocked", process.process_number, process.state_queue.peek()[1])
         else:
             # The ready state is empty so we need to step in time and see if we can free anything
             current_time += 1
@@ -469,7 +1303,15 @@ def shortest_job_remaining(processes, verbose=False):
                     print("yes")
                     print("Time " + str(current_time) + ": Adding " + str(len(ready_processes)) + " to ready state")
                 for ready_process in ready_processes:
-                    ready_state.add(ready_process)
+                    if ready_process.state_queue.empty:
+                        if verbose:
+                            print("Time " + str(current_time) + ": " + str(ready_process) + " finished")
+                        if recorder:
+                            recorder.record(current_time, "finished", ready_process.process_number)
+                    else:
+                        ready_state.add(ready_process)
+                        if recorder:
+                            recorder.record(current_time, "unblocked", ready_process.process_number)
             else:
                 if verbose:
                     print("no")
@@ -484,6 +1326,8 @@ def shortest_job_remaining(processes, verbose=False):
                 for ready_process in ready_processes:
                     ready_process.start_process()
                     ready_state.add(ready_process)
+                    if recorder:
+                        recorder.record(current_time, "arrived", ready_process.process_number)
             else:
                 if verbose:
                     print("no")
@@ -491,16 +1335,190 @@ def shortest_job_remaining(processes, verbose=False):
                 print("Time " + str(current_time) + ":")
                 print_states(start_state, ready_state, blocked_state)
 
-    print("end")
+    schedule.close()
+
+
+# CYCLE DETECTION
+
+class CycleDetector:
+    def __init__(self, processes, schedule, max_history=4096):
+        # Every state of every process so that we can check whether the workload keeps repeating
+        self.process_states = {process: tuple(process.state_queue) for process in processes}
+        # Processes that still have states left, pruned as they finish
+        self.processes = list(processes)
+        self.schedule = schedule
+        self.max_history = max_history
+        # Maps the hash of each signature seen to the check it was seen on, which is all we keep until one repeats
+        self.history = {}
+        self.checks = 0
+        # A signature takes as long to build as there are processes so only take one every that many times round
+        # The stride doubles whenever max_history signatures go by without a repeat
+        self.stride = max(len(self.processes), 1)
+        self.countdown = 1
+        # The signature that repeated with the time, remaining state counts, check it was seen on and check to give up on
+        # The runs and events are only kept while there is a candidate since they're only needed to skip ahead
+        self.candidate = None
+        self.runs = []
+        # The SJF picks and completed bursts, needed to replay the burst estimates
+        self.events = []
+
+    def run(self, process_number, start, end):
+        if self.candidate:
+            self.runs.append((process_number, start, end))
+        self.schedule.run(process_number, start, end)
+
+    def idle(self, start, end):
+        self.run(IDLE, start, end)
+
+    def close(self):
+        self.schedule.close()
+
+    def picked(self, process, ready_processes):
+        if self.candidate:
+            self.events.append(("picked", process, list(ready_processes)))
+
+    def burst_completed(self, process, burst_time):
+        if self.candidate:
+            self.events.append(("burst", process, burst_time))
+
+    def due(self):
+        # Whether a signature should be taken this time round, which saves building one when it won't be checked
+        self.countdown -= 1
+        if self.countdown > 0:
+            return False
+        self.countdown = self.stride
+        return True
+
+    def remaining(self):
+        self.processes = [process for process in self.processes if process.state_queue]
+        return {process: len(process.state_queue) for process in self.processes}
+
+    def watch(self, current_time, signature, cycle_checks):
+        # Starts keeping the runs and events from here to see whether the signature comes round again
+        # Gives up after twice as many checks as it took to repeat in case it was only a hash collision
+        self.candidate = (hash(signature), signature, current_time, self.remaining(), self.checks,
+                          self.checks + 2 * cycle_checks)
+        self.runs = []
+        self.events = []
+
+    def restart(self):
+        self.history = {}
+        self.candidate = None
+        self.runs = []
+        self.events = []
+
+    def check(self, current_time, signature):
+        # Skips ahead over as many whole cycles as we can if this signature has been seen before
+        # Returns the amount of time skipped, which is 0 when nothing could be skipped
+        self.checks += 1
+        signature_hash = hash(signature)
+        if self.candidate is None:
+            if signature_hash in self.history:
+                self.watch(current_time, signature, self.checks - self.history[signature_hash])
+            elif len(self.history) >= self.max_history:
+                # Nothing has repeated in a long time so look less often from now on
+                self.history = {signature_hash: self.checks}
+                self.stride *= 2
+            else:
+                self.history[signature_hash] = self.checks
+            return 0
+        candidate_hash, candidate_signature, cycle_start, cycle_remaining, first_check, last_check = self.candidate
+        if signature_hash != candidate_hash or signature != candidate_signature:
+            if self.checks >= last_check:
+                self.restart()
+            return 0
+        remaining = self.remaining()
+        cycle_time = current_time - cycle_start
+        # How many states each process got through in one cycle
+        consumed = {process: cycle_remaining[process] - remaining[process] for process in remaining}
+        cycle_count = self.repeating_cycles(remaining, consumed)
+        if cycle_time > 0 and cycle_count > 0:
+            cycle_count = self.replay_estimates(self.events, cycle_count)
+        if cycle_time <= 0 or cycle_count == 0:
+            # Start measuring again from here in case the pattern picks up again later
+            self.watch(current_time, signature, self.checks - first_check)
+            return 0
+        # Drop the states we are skipping over, keeping the partly used state at the front as it is
+        for process, process_consumed in consumed.items():
+            if process_consumed > 0:
+                current_state = process.state_queue.pop_front()
+                for _ in range(cycle_count * process_consumed):
+                    process.state_queue.pop_front()
+                process.state_queue.push_front(current_state)
+        for cycle in range(1, cycle_count + 1):
+            for process_number, start, end in self.runs:
+                self.schedule.run(process_number, start + cycle * cycle_time, end + cycle * cycle_time)
+        # Whatever comes next is a new pattern so go back to looking for it closely
+        self.restart()
+        self.stride = max(len(self.processes), 1)
+        self.countdown = 1
+        return cycle_count * cycle_time
+
+    def repeating_cycles(self, remaining, consumed):
+        # Returns how many more times the last cycle can repeat before some process's states stop matching it
+        cycle_count = None
+        for process in remaining:
+            if consumed[process] == 0:
+                continue
+            states = self.process_states[process]
+            current_position = len(states) - remaining[process]
+            # The state at the front after the last cycle has to match as well since it is part way through
+            limit = len(states) if cycle_count is None else current_position + cycle_count * consumed[process] + 1
+            position = current_position
+            while position < min(limit, len(states)) and states[position] == states[position - consumed[process]]:
+                position += 1
+            process_cycles = max(position - current_position - 1, 0) // consumed[process]
+            cycle_count = process_cycles if cycle_count is None else min(cycle_count, process_cycles)
+        return cycle_count or 0
+
+    def replay_estimates(self, events, cycle_count):
+        # Plays the burst estimates forward one cycle at a time and stops before the first cycle where they would
+        # lead to a different process being picked, then leaves the estimates where the last good cycle put them
+        if not events:
+            return cycle_count
+        estimates = {}
+        for event in events:
+            estimates[event[1]] = (event[1].average_burst_time, event[1].burst_count)
+            if event[0] == "picked":
+                for process in event[2]:
+                    estimates[process] = (process.average_burst_time, process.burst_count)
+        global_estimate = (global_average_burst_time[0], global_burst_count[0])
+        replayed_cycles = 0
+        while replayed_cycles < cycle_count:
+            cycle_estimates = dict(estimates)
+            cycle_global_estimate = global_estimate
+            for kind, process, value in events:
+                if kind == "picked":
+                    if any((cycle_estimates[other][0], other) < (cycle_estimates[process][0], process)
+                           for other in value):
+                        break
+                else:
+                    average, count = cycle_estimates[process]
+                    cycle_estimates[process] = (((average * count) + value) / (count + 1), count + 1)
+                    average, count = cycle_global_estimate
+                    cycle_global_estimate = (((average * count) + value) / (count + 1), count + 1)
+            else:
+                estimates = cycle_estimates
+                global_estimate = cycle_global_estimate
+                replayed_cycles += 1
+                continue
+            break
+        for process, (average, count) in estimates.items():
+            process.average_burst_time = average
+            process.burst_count = count
+        global_average_burst_time[0], global_burst_count[0] = global_estimate
+        return replayed_cycles
 
 
 # PROCESS CLASS
 
 class Process:
-    def __init__(self, process_file):
-        self.validate_process_file_name(process_file)
+    def __init__(self, process_file, start=None, states=None):
+        # The start time and states can be passed in when the process file has already been parsed
+        if states is None:
+            self.validate_process_file_name(process_file)
         self.process_file = process_file
-        self.state_queue = ProcessQueue()
+        self.state_queue = ProcessQueue() if states is None else ProcessQueue(states)
         process_filename = os.path.split(process_file)[1]
         self.process_number = re.search('\d+', process_filename).group()
         # If this is the very start of the simulation assume everyone is going to run forever
@@ -508,34 +1526,22 @@ class Process:
         self.average_burst_time = float("inf")
         self.burst_count = 0
         self.partial_burst_time = 0
+        if states is not None:
+            self.start = start
+            return
         with open(self.process_file, 'r') as f:
             try:
-                self.start = -1
-                for line in f.readlines():
-                    if line.strip() == "":
-                        continue
-                    line_parts = line.split()
-                    if line_parts[0] == "start":
-                        self.start = int(line_parts[1])
-                    elif line_parts[0] == "end":
-                        # We're done in this case
-                        pass
-                    else:
-                        self.state_queue.push_back((line_parts[0], int(line_parts[1])))
-                if self.start == -1:
-                    raise ValueError()
-                if len(self.state_queue) == 0:
-                    print("The process file \"" + process_file + "\" is empty.", file=sys.stderr)
-                    raise ValueError()
-            except:
-                print("An error occurred while loading the process file \"" + process_file + "\"", file=sys.stderr)
+                self.start, states = parse_process_text(f.read())
+                self.state_queue.extend(states)
+            except (UnicodeDecodeError, ValueError) as e:
+                print("An error occurred while loading the process file \"" + process_file + "\": " + str(e),
+                      file=sys.stderr)
                 exit(1)
 
     @staticmethod
     def validate_process_file_name(process_file):
         path, filename = os.path.split(process_file)
-        file_pattern = re.compile('process-\d+\.txt')
-        if len(file_pattern.findall(filename)) == 0:
+        if len(process_file_pattern.findall(filename)) == 0:
             print("Process files must have names of the format `process-N.txt`", file=sys.stderr)
             exit(1)
         if not os.path.isfile(process_file):
@@ -617,6 +1623,18 @@ class ReadyPool:
         else:
             self.processes[burst_time] = {process}
 
+    def refresh(self):
+        # Files every process again under its current burst remaining
+        processes = list(self)
+        self.processes = {}
+        for process in processes:
+            self.add(process)
+
+    def __iter__(self):
+        for burst_time in self.processes:
+            for process in self.processes[burst_time]:
+                yield process
+
     @property
     def empty(self):
         return len(self.processes) == 0
@@ -689,7 +1707,7 @@ class StartPool:
 
     def add(self, process):
         if process.start in self.processes:
-            self.processes.append(process)
+            self.processes[process.start].append(process)
         else:
             self.processes[process.start] = [process]
 
@@ -772,5 +1790,279 @@ class ProcessQueue(deque):
         return s
 
 
+# SCHEDULE OUTPUT
+
+IDLE = "Idle"
+SCHEDULE_FILE_MAGIC = b"SCHD"
+SCHEDULE_FILE_VERSION = 1
+# Header is the magic, version, padding, index stride, record count and the offset of the index
+schedule_file_header = struct.Struct("<4sHHIQQ")
+# Each record is the start time, end time and process number of one run, with idle time stored as process -1
+schedule_file_record = struct.Struct("<qqq")
+schedule_file_index_entry = struct.Struct("<q")
+
+
+class ScheduleLog:
+    def __init__(self, writers=None, coalesce=True):
+        if writers is None:
+            writers = [ScheduleTextWriter()]
+        self.writers = writers
+        self.coalesce = coalesce
+        # The run that is still allowed to grow if the same process keeps going
+        self.pending_run = None
+
+    def run(self, process_number, start, end):
+        if not self.coalesce:
+            self.write(process_number, start, end)
+            return
+        if self.pending_run is not None:
+            pending_number, pending_start, pending_end = self.pending_run
+            if pending_number == process_number and pending_end == start:
+                self.pending_run = (pending_number, pending_start, end)
+                return
+            self.write(*self.pending_run)
+        self.pending_run = (process_number, start, end)
+
+    def idle(self, start, end):
+        self.run(IDLE, start, end)
+
+    def write(self, process_number, start, end):
+        for writer in self.writers:
+            writer.write(process_number, start, end)
+
+    def close(self):
+        if self.pending_run is not None:
+            self.write(*self.pending_run)
+            self.pending_run = None
+        for writer in self.writers:
+            writer.close()
+
+
+class ScheduleTextWriter:
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def write(self, process_number, start, end):
+        print(str(process_number) + " " + str(start) + " " + str(end), file=self.stream or sys.stdout)
+
+    def close(self):
+        print("end", file=self.stream or sys.stdout)
+
+
+class ScheduleRuns:
+    def __init__(self):
+        self.runs = []
+
+    def write(self, process_number, start, end):
+        self.runs.append([process_number, start, end])
+
+    def close(self):
+        pass
+
+
+class ScheduleMetrics:
+    def __init__(self, processes):
+        self.arrivals = {}
+        # Time spent blocked on IO between runs, which doesn't count as waiting for the CPU
+        self.io_times = {}
+        for process in processes:
+            self.arrivals[process.process_number] = process.start
+            states = list(process.state_queue)
+            # IO at the very end happens after the last run so it never shows up in the schedule
+            while states and states[-1][0] != "B":
+                states.pop()
+            self.io_times[process.process_number] = sum(state_time for kind, state_time in states if kind != "B")
+        self.cpu_times = {}
+        self.first_runs = {}
+        self.completions = {}
+        self.idle_time = 0
+        self.dispatches = 0
+        self.makespan = 0
+
+    def write(self, process_number, start, end):
+        self.makespan = max(self.makespan, end)
+        if process_number == IDLE:
+            self.idle_time += end - start
+            return
+        self.dispatches += 1
+        self.cpu_times[process_number] = self.cpu_times.get(process_number, 0) + end - start
+        self.first_runs.setdefault(process_number, start)
+        self.completions[process_number] = end
+
+    def close(self):
+        pass
+
+    def summary(self):
+        turnarounds = [self.completions[number] - self.arrivals[number] for number in self.completions]
+        waits = [self.completions[number] - self.arrivals[number] - self.cpu_times[number] - self.io_times[number]
+                 for number in self.completions]
+        responses = [self.first_runs[number] - self.arrivals[number] for number in self.first_runs]
+        process_count = max(len(self.completions), 1)
+        return {
+            "makespan": self.makespan,
+            "cpu_utilization": sum(self.cpu_times.values()) / self.makespan if self.makespan else 0.0,
+            "idle_time": self.idle_time,
+            "dispatches": self.dispatches,
+            "average_turnaround": sum(turnarounds) / process_count,
+            "maximum_turnaround": max(turnarounds, default=0),
+            "average_waiting": sum(waits) / process_count,
+            "average_response": sum(responses) / process_count,
+        }
+
+
+class ScheduleFileWriter:
+    def __init__(self, path, index_stride=256):
+        self.file = open(path, "wb")
+        self.index_stride = index_stride
+        self.record_count = 0
+        # Start time of the first record in every block of index_stride records
+        self.index = []
+        # The real header is written once we know how many records there are
+        self.file.write(b"\0" * schedule_file_header.size)
+
+    def write(self, process_number, start, end):
+        if self.record_count % self.index_stride == 0:
+            self.index.append(start)
+        number = -1 if process_number == IDLE else int(process_number)
+        self.file.write(schedule_file_record.pack(start, end, number))
+        self.record_count += 1
+
+    def close(self):
+        index_offset = self.file.tell()
+        for start in self.index:
+            self.file.write(schedule_file_index_entry.pack(start))
+        self.file.seek(0)
+        self.file.write(schedule_file_header.pack(SCHEDULE_FILE_MAGIC, SCHEDULE_FILE_VERSION, 0, self.index_stride,
+                                                  self.record_count, index_offset))
+        self.file.close()
+
+
+class ScheduleFile:
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        header = self.file.read(schedule_file_header.size)
+        if len(header) != schedule_file_header.size:
+            self.file.close()
+            raise ValueError("\"" + path + "\" is not a schedule file")
+        magic, version, _, self.index_stride, self.record_count, index_offset = schedule_file_header.unpack(header)
+        if magic != SCHEDULE_FILE_MAGIC or version != SCHEDULE_FILE_VERSION:
+            self.file.close()
+            raise ValueError("\"" + path + "\" is not a schedule file")
+        self.file.seek(index_offset)
+        index_data = self.file.read()
+        self.index = [entry[0] for entry in schedule_file_index_entry.iter_unpack(index_data)]
+
+    def read_block(self, block):
+        # Returns the records in the block as (process number, start, end) tuples
+        first_record = block * self.index_stride
+        record_count = min(self.index_stride, self.record_count - first_record)
+        self.file.seek(schedule_file_header.size + first_record * schedule_file_record.size)
+        data = self.file.read(record_count * schedule_file_record.size)
+        return [(IDLE if number == -1 else str(number), start, end)
+                for start, end, number in schedule_file_record.iter_unpack(data)]
+
+    def runs_between(self, from_time, to_time):
+        # Yields every run that overlaps [from_time, to_time) without touching the blocks before it
+        block = max(bisect_right(self.index, from_time) - 1, 0)
+        records = self.read_block(block) if block < len(self.index) else []
+        # Runs never overlap so only the last one starting at or before from_time can reach into the window
+        position = max(bisect_right([record[1] for record in records], from_time) - 1, 0)
+        while position < len(records):
+            run = records[position]
+            if run[1] >= to_time:
+                return
+            if run[2] > from_time:
+                yield run
+            position += 1
+            if position == len(records):
+                block += 1
+                records = self.read_block(block) if block < len(self.index) else []
+                position = 0
+
+    def running_at(self, at_time):
+        # Returns the run that was happening at the given time or None if the schedule doesn't cover it
+        for run in self.runs_between(at_time, at_time + 1):
+            return run
+        return None
+
+    def cpu_share(self, process_number, from_time, to_time):
+        # Returns the fraction of [from_time, to_time) that the process spent running
+        if to_time <= from_time:
+            raise ValueError("The end of the time window must come after its start")
+        # Compared as numbers since the file doesn't keep the leading zeros of process-03.txt
+        process_number = IDLE if process_number == IDLE else str(int(process_number))
+        running_time = 0
+        for number, start, end in self.runs_between(from_time, to_time):
+            if number == process_number:
+                running_time += min(end, to_time) - max(start, from_time)
+        return running_time / (to_time - from_time)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# FLIGHT RECORDER
+
+def process_trigger(process_number):
+    # Compared as numbers so that process 3 matches process-03.txt
+    return lambda event: event[2] is not None and int(event[2]) == process_number
+
+
+def time_window_trigger(from_time, to_time):
+    # Runs and idle periods carry their end time as the value so they fire the trigger if any part of them overlaps
+    def trigger(event):
+        if event[1] in ("ran", "idle"):
+            return event[0] < to_time and event[3] > from_time
+        return from_time <= event[0] < to_time
+    return trigger
+
+
+class FlightRecorder:
+    def __init__(self, size, triggers=None, stream=None):
+        # Events are kept as (time, kind, process number, value) tuples and only formatted when dumped
+        self.events = deque(maxlen=size)
+        # Each trigger only fires once so a long run can't flood the output with dumps
+        self.triggers = [] if triggers is None else list(triggers)
+        self.stream = stream
+        # Pools and queues are snapshotted as they are at the moment of a dump
+        self.pools = []
+        self.queues = []
+
+    def watch(self, *pools):
+        self.pools += pools
+
+    def watch_queue(self, name, process_queue):
+        self.queues.append((name, process_queue))
+
+    def record(self, event_time, kind, process_number=None, value=None):
+        event = (event_time, kind, process_number, value)
+        self.events.append(event)
+        if self.triggers:
+            for trigger in [trigger for trigger in self.triggers if trigger(event)]:
+                self.triggers.remove(trigger)
+                self.dump("trigger")
+
+    def dump(self, reason):
+        stream = self.stream or sys.stderr
+        print("Flight recorder dump (" + reason + "), last " + str(len(self.events)) + " events:", file=stream)
+        for event_time, kind, process_number, value in self.events:
+            line = "Time " + str(event_time) + ": " + kind
+            if process_number is not None:
+                line += " " + str(process_number)
+            if value is not None:
+                line += " " + str(value)
+            print(line, file=stream)
+        for pool in self.pools:
+            print(pool, file=stream)
+        for name, process_queue in self.queues:
+            print(name + ": " + process_queue.single_line_string(), file=stream)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,473 @@
+"""
+Regression checks for scheduler.py, run with `python -m unittest` or `python -m pytest`
+"""
+
+import http.client
+import io
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import scheduler
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_FILES = [os.path.join(REPO_DIR, "process-" + str(i) + ".txt") for i in (1, 2, 3)]
+
+# The SJF schedule of the sample files as the original program printed it
+SAMPLE_SJF_SCHEDULE = """1 0 5
+Idle 5 7
+1 7 9
+1 9 12
+Idle 12 110
+2 110 120
+2 120 320
+3 320 420
+1 420 430
+2 430 530
+3 530 1530
+2 1530 1630
+2 1630 1730
+2 1730 1830
+end
+"""
+
+
+def run_scheduler(*arguments):
+    result = subprocess.run([sys.executable, os.path.join(REPO_DIR, "scheduler.py")] + list(arguments),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise AssertionError("scheduler.py " + " ".join(arguments) + " failed:\n" + result.stderr)
+    return result.stdout
+
+
+def write_process_files(directory, processes):
+    # Each process is a (start, states) pair and is written out as process-N.txt numbered from 1
+    for number, (start, states) in enumerate(processes, 1):
+        with open(os.path.join(directory, "process-" + str(number) + ".txt"), "w") as f:
+            f.write("start " + str(start) + "\n")
+            for kind, state_time in states:
+                f.write(kind + " " + str(state_time) + "\n")
+            f.write("end\n")
+
+
+def parse_schedule(output):
+    runs = []
+    for line in output.splitlines():
+        if line != "end":
+            process_number, start, end = line.split()
+            runs.append((process_number, int(start), int(end)))
+    return runs
+
+
+def merge_runs(runs):
+    merged = []
+    for run in runs:
+        if merged and merged[-1][0] == run[0] and merged[-1][2] == run[1]:
+            merged[-1] = (run[0], merged[-1][1], run[2])
+        else:
+            merged.append(run)
+    return merged
+
+
+class ScheduleLogTest(unittest.TestCase):
+    def test_no_coalesce_matches_original_output(self):
+        self.assertEqual(run_scheduler("SJF", "--no-coalesce", *SAMPLE_FILES), SAMPLE_SJF_SCHEDULE)
+
+    def test_no_coalesce_writes_runs_straight_through(self):
+        runs = scheduler.ScheduleRuns()
+        schedule = scheduler.ScheduleLog([runs], coalesce=False)
+        schedule.run("1", 0, 3)
+        self.assertEqual(runs.runs, [["1", 0, 3]])
+
+    def test_coalesced_runs_merge_back_to_back_slices(self):
+        for arguments in (["RR", "3"], ["RR", "50"], ["SJF"], ["SJR"]):
+            sliced = parse_schedule(run_scheduler(*(arguments + ["--no-coalesce"] + SAMPLE_FILES)))
+            coalesced = parse_schedule(run_scheduler(*(arguments + SAMPLE_FILES)))
+            self.assertEqual(coalesced, merge_runs(sliced))
+
+    def test_verbose_output_is_never_coalesced(self):
+        for arguments in (["RR", "3"], ["SJF"]):
+            self.assertEqual(run_scheduler(*(arguments + ["verbose"] + SAMPLE_FILES)),
+                             run_scheduler(*(arguments + ["verbose", "--no-coalesce"] + SAMPLE_FILES)))
+
+
+class ScheduleFileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "schedule.bin")
+        self.runs = parse_schedule(run_scheduler("RR", "3", "--no-coalesce", *SAMPLE_FILES))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_schedule_file(self, index_stride):
+        writer = scheduler.ScheduleFileWriter(self.path, index_stride)
+        for run in self.runs:
+            writer.write(*run)
+        writer.close()
+        return scheduler.ScheduleFile(self.path)
+
+    def test_queries_match_a_full_scan(self):
+        end_time = self.runs[-1][2]
+        rng = random.Random(0)
+        for index_stride in (1, 3, 256):
+            with self.write_schedule_file(index_stride) as schedule_file:
+                for at_time in range(-2, end_time + 3):
+                    expected = [run for run in self.runs if run[1] <= at_time < run[2]]
+                    self.assertEqual(schedule_file.running_at(at_time), expected[0] if expected else None)
+                for _ in range(200):
+                    from_time = rng.randint(-5, end_time + 5)
+                    to_time = from_time + rng.randint(1, 500)
+                    expected = sum(max(0, min(end, to_time) - max(start, from_time))
+                                   for number, start, end in self.runs if number == "2")
+                    self.assertAlmostEqual(schedule_file.cpu_share("2", from_time, to_time),
+                                           expected / (to_time - from_time))
+
+    def test_schedule_file_option_matches_printed_schedule(self):
+        output = run_scheduler("RR", "3", "--schedule-file", self.path, *SAMPLE_FILES)
+        printed = parse_schedule(output)
+        with scheduler.ScheduleFile(self.path) as schedule_file:
+            self.assertEqual(list(schedule_file.runs_between(0, printed[-1][2])), printed)
+        self.assertEqual(run_scheduler("query", self.path, "at", "120"), "2 110 213\n")
+
+    def test_share_matches_padded_process_numbers(self):
+        padded = os.path.join(self.directory.name, "process-03.txt")
+        with open(padded, "w") as f:
+            f.write("start 0\nB 3\nend\n")
+        run_scheduler("SJF", "--schedule-file", self.path, padded)
+        for process_number in ("03", "3"):
+            self.assertEqual(run_scheduler("query", self.path, "share", process_number, "0", "3"), "1.0\n")
+
+
+class WorkloadDirTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_both_loaders_accept_the_start_line_anywhere(self):
+        path = os.path.join(self.directory.name, "process-1.txt")
+        with open(path, "w") as f:
+            f.write("B 3\n\nstart 0\nI 4 extra\nB 2\nend\n")
+        expected = (0, [("B", 3), ("I", 4), ("B", 2)])
+        loaded = scheduler.load_workload_dir(self.directory.name)[0]
+        self.assertEqual((loaded.start, list(loaded.state_queue)), expected)
+        process = scheduler.Process(path)
+        self.assertEqual((process.start, list(process.state_queue)), expected)
+
+    def test_workload_dir_matches_positional_files(self):
+        processes = [(start, [("B", 4), ("I", 7), ("B", 3)]) for start in (0, 2, 2, 9)]
+        write_process_files(self.directory.name, processes)
+        paths = [os.path.join(self.directory.name, "process-" + str(i) + ".txt") for i in range(1, 5)]
+        for arguments in (["RR", "3"], ["SJF"]):
+            self.assertEqual(run_scheduler(*(arguments + ["--workload-dir", self.directory.name])),
+                             run_scheduler(*(arguments + paths)))
+
+
+class CompareTest(unittest.TestCase):
+    def test_duplicate_process_numbers_are_rejected(self):
+        with tempfile.TemporaryDirectory() as directory:
+            write_process_files(directory, [(0, [("B", 3)])])
+            padded = os.path.join(directory, "process-01.txt")
+            with open(padded, "w") as f:
+                f.write("start 0\nB 3\nend\n")
+            for arguments in (["--workload-dir", directory, SAMPLE_FILES[0]], [SAMPLE_FILES[0], padded]):
+                result = subprocess.run([sys.executable, os.path.join(REPO_DIR, "scheduler.py"), "compare"] + arguments,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+                self.assertEqual(result.returncode, 1)
+                self.assertIn("Process 1 is loaded from both", result.stderr)
+
+    def test_compare_matches_single_runs(self):
+        rows = {}
+        for line in run_scheduler("compare", "--quanta", "3", *SAMPLE_FILES).splitlines()[1:]:
+            name, *values = line.rsplit(None, 3)
+            rows[name] = values
+        for column, arguments in enumerate((["RR", "3"], ["SJF"], ["SJR"])):
+            runs = parse_schedule(run_scheduler(*(arguments + SAMPLE_FILES)))
+            self.assertEqual(int(rows["Makespan"][column]), runs[-1][2])
+            self.assertEqual(int(rows["Idle time"][column]), sum(end - start for number, start, end in runs
+                                                                 if number == "Idle"))
+            self.assertEqual(int(rows["Dispatches"][column]), len([run for run in runs if run[0] != "Idle"]))
+
+    def test_workloads_ending_in_io_run_under_every_algorithm(self):
+        with tempfile.TemporaryDirectory() as directory:
+            write_process_files(directory, [(0, [("B", 3), ("I", 5)]), (1, [("B", 4), ("I", 2), ("B", 2)])])
+            for arguments in (["SJR"], ["SJF"], ["RR", "2"]):
+                self.assertEqual(parse_schedule(run_scheduler(*(arguments + ["--workload-dir", directory])))[-1],
+                                 ("2", 9, 11))
+            self.assertIn("SJR", run_scheduler("compare", "--workload-dir", directory).splitlines()[0])
+
+    def test_failed_runs_get_their_own_column(self):
+        stdout = sys.stdout
+        sys.stdout = io.StringIO()
+        try:
+            metrics = {"makespan": 10, "cpu_utilization": 1.0, "idle_time": 0, "dispatches": 2,
+                       "average_turnaround": 5.0, "maximum_turnaround": 10, "average_waiting": 0.0,
+                       "average_response": 0.0}
+            scheduler.print_comparison([("RR", 1), ("SJR", None)], [metrics, IndexError("pop from an empty deque")])
+            rows = sys.stdout.getvalue().splitlines()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(rows[1].split(), ["Makespan", "10", "failed"])
+
+
+class FlightRecorderTest(unittest.TestCase):
+    def run_round_robin(self, recorder, processes):
+        with tempfile.TemporaryDirectory() as directory:
+            write_process_files(directory, processes)
+            loaded = scheduler.load_workload_dir(directory)
+        schedule = scheduler.ScheduleLog([scheduler.ScheduleRuns()])
+        scheduler.round_robin(loaded, 3, schedule=schedule, recorder=recorder)
+
+    def test_blocked_ticks_are_recorded_once_per_wait(self):
+        stream = io.StringIO()
+        recorder = scheduler.FlightRecorder(5, stream=stream)
+        self.run_round_robin(recorder, [(0, [("B", 2), ("I", 50), ("B", 1)])])
+        blocked_events = [event for event in recorder.events if event[1] == "blocked"]
+        self.assertEqual(blocked_events, [(2, "blocked", "1", 50)])
+
+    def test_dump_shows_the_blocked_process_still_queued(self):
+        stream = io.StringIO()
+        # The window only covers the moment the process is found blocked
+        recorder = scheduler.FlightRecorder(10, [scheduler.time_window_trigger(2, 3)], stream)
+        self.run_round_robin(recorder, [(0, [("B", 2), ("I", 50), ("B", 1)])])
+        self.assertIn("Process queue: [Process 1]", stream.getvalue())
+
+    def test_process_trigger_compares_numbers(self):
+        trigger = scheduler.process_trigger(3)
+        self.assertTrue(trigger((0, "arrived", "03", None)))
+        self.assertFalse(trigger((0, "idle", None, 5)))
+
+    def test_time_window_fires_for_runs_that_span_it(self):
+        trigger = scheduler.time_window_trigger(350, 360)
+        self.assertTrue(trigger((320, "ran", "3", 420)))
+        self.assertTrue(trigger((340, "idle", None, 351)))
+        self.assertFalse(trigger((320, "ran", "3", 350)))
+        self.assertFalse(trigger((320, "blocked", "3", 100)))
+        output = subprocess.run([sys.executable, os.path.join(REPO_DIR, "scheduler.py"), "SJF", "--flight-recorder", "5",
+                                 "--dump-window", "350", "360"] + SAMPLE_FILES,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        self.assertIn("Time 320: ran 3 420", output.stderr)
+
+    def test_sjf_records_unblocked_processes_when_the_burst_ends(self):
+        recorder = scheduler.FlightRecorder(100, stream=io.StringIO())
+        processes = [scheduler.Process(process_file) for process_file in SAMPLE_FILES]
+        scheduler.reset_global_averages()
+        scheduler.shortest_job_first(processes, schedule=scheduler.ScheduleLog([scheduler.ScheduleRuns()]),
+                                     recorder=recorder)
+        events = list(recorder.events)
+        ran = events.index((320, "ran", "3", 420))
+        self.assertIn((420, "unblocked", "1", None), events[ran + 1:])
+        self.assertNotIn((320, "unblocked", "1", None), events)
+
+
+class FastForwardTest(unittest.TestCase):
+    def simulate(self, workload, algorithm, fast_forward):
+        processes = [scheduler.Process("process-" + str(number) + ".txt", start, states)
+                     for number, (start, states) in enumerate(workload, 1)]
+        runs = scheduler.ScheduleRuns()
+        recorder = scheduler.FlightRecorder(1000000, stream=io.StringIO())
+        scheduler.reset_global_averages()
+        if algorithm == "SJF":
+            scheduler.shortest_job_first(processes, schedule=scheduler.ScheduleLog([runs]), recorder=recorder,
+                                         fast_forward=fast_forward)
+        else:
+            scheduler.round_robin(processes, algorithm, schedule=scheduler.ScheduleLog([runs]), recorder=recorder,
+                                  fast_forward=fast_forward)
+        skipped = [event for event in recorder.events if event[1] == "fast-forwarded"]
+        return runs.runs, skipped
+
+    def random_workload(self, rng, periodic):
+        workload = []
+        for _ in range(rng.randint(1, 4)):
+            pattern = []
+            for _ in range(rng.randint(1, 3)):
+                pattern += [("B", rng.randint(1, 12)), ("I", rng.randint(1, 20))]
+            states = pattern * rng.randint(5, 100) if periodic else pattern * 2
+            if rng.random() < 0.5:
+                # Break the pattern somewhere so the detector has to stop short of it
+                position = rng.randrange(len(states))
+                states[position] = (states[position][0], states[position][1] + rng.randint(1, 5))
+            if rng.random() < 0.3:
+                states = states[:-1]
+            workload.append((rng.randint(0, 30), states))
+        return workload
+
+    def test_fast_forward_matches_a_full_simulation(self):
+        rng = random.Random(0)
+        for case in range(40):
+            workload = self.random_workload(rng, case % 4 != 0)
+            for algorithm in (1, 3, 7, "SJF"):
+                expected, _ = self.simulate(workload, algorithm, False)
+                actual, _ = self.simulate(workload, algorithm, True)
+                self.assertEqual(actual, expected, "case " + str(case) + " with " + str(algorithm))
+
+    def test_periodic_workloads_are_skipped(self):
+        workload = [(0, [("B", 4), ("I", 9)] * 200), (2, [("B", 3), ("I", 5), ("B", 2), ("I", 7)] * 150)]
+        for algorithm in (3, "SJF"):
+            runs, skipped = self.simulate(workload, algorithm, True)
+            self.assertTrue(skipped, str(algorithm) + " never fast forwarded")
+            self.assertEqual(runs, self.simulate(workload, algorithm, False)[0])
+
+    def test_signatures_are_taken_less_often_when_nothing_repeats(self):
+        processes = [scheduler.Process("process-" + str(number) + ".txt", 0, [("B", 1)]) for number in (1, 2)]
+        detector = scheduler.CycleDetector(processes, scheduler.ScheduleLog([scheduler.ScheduleRuns()]), 8)
+        taken = 0
+        for current_time in range(200):
+            if detector.due():
+                detector.check(current_time, (current_time,))
+                taken += 1
+        self.assertEqual(detector.stride, 16)
+        self.assertLess(taken, 40)
+        self.assertIsNone(detector.candidate)
+        self.assertEqual(detector.runs, [])
+
+
+class ServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "scheduler.py"), "serve", "--port", "0",
+                                       "--workers", "1"], stderr=subprocess.PIPE, universal_newlines=True)
+        cls.port = int(cls.server.stderr.readline().rsplit(":", 1)[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.terminate()
+        cls.server.wait()
+        cls.server.stderr.close()
+
+    def post(self, body, headers=None):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+        connection.request("POST", "/simulate", body, headers or {})
+        response = connection.getresponse()
+        result = response.status, json.loads(response.read())
+        connection.close()
+        return result
+
+    def simulate(self, processes):
+        return self.post(json.dumps({"algorithm": "RR", "quantum": 3, "processes": processes}))
+
+    def test_simulates_the_sample_files(self):
+        processes = []
+        for number, process_file in enumerate(SAMPLE_FILES, 1):
+            with open(process_file) as f:
+                processes.append({"number": number, "text": f.read()})
+        status, result = self.simulate(processes)
+        self.assertEqual(status, 200)
+        self.assertEqual(result["metrics"]["makespan"], 1830)
+
+    def test_bad_bodies_are_rejected(self):
+        self.assertEqual(self.post("{}", {"Content-Length": "-1"})[0], 400)
+        self.assertEqual(self.post("[" * 100000 + "]" * 100000)[0], 400)
+
+    def test_bad_processes_are_rejected(self):
+        for processes in ([{"number": 1, "start": 0, "states": [["B", 3]]},
+                           {"number": 1, "start": 2, "states": [["B", 3]]}],
+                          [{"number": 1, "start": -1, "states": [["B", 3]]}],
+                          [{"number": 1, "start": 0, "states": [["B", 3], ["I", -2], ["B", 1]]}],
+                          [{"number": 1, "text": "start 0\nB -3\nend"}],
+                          [{"number": 1, "start": 0, "states": [["B", 3], ["X", 2], ["B", 1]]}],
+                          [{"number": 1, "text": "start 0\nB 3\nX 2\nend"}],
+                          [{"number": True, "start": 0, "states": [["B", 3]]}],
+                          [{"number": 1, "start": 0.5, "states": [["B", 3]]}],
+                          [{"number": 1, "start": 0, "states": [["B", 2.5]]}],
+                          [{"number": 1, "start": 0, "states": [["B", True]]}]):
+            status, result = self.simulate(processes)
+            self.assertEqual(status, 400, result)
+        status, result = self.post(json.dumps({"algorithm": "RR", "quantum": True,
+                                               "processes": [{"number": 1, "start": 0, "states": [["B", 3]]}]}))
+        self.assertEqual(status, 400, result)
+
+
+class ServerSocketTest(unittest.TestCase):
+    def start_server(self, socket_path):
+        return subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "scheduler.py"), "serve", "--socket",
+                                 socket_path, "--workers", "1"], stderr=subprocess.PIPE, universal_newlines=True)
+
+    def test_socket_of_a_running_server_is_left_alone(self):
+        with tempfile.TemporaryDirectory() as directory:
+            socket_path = os.path.join(directory, "s.sock")
+            server = self.start_server(socket_path)
+            try:
+                self.assertIn("Listening on", server.stderr.readline())
+                second = self.start_server(socket_path)
+                second.wait(30)
+                self.assertEqual(second.returncode, 1)
+                self.assertIn("already in use", second.stderr.read())
+                second.stderr.close()
+                self.assertIsNone(server.poll())
+                self.assertTrue(os.path.exists(socket_path))
+            finally:
+                server.terminate()
+                server.wait()
+                server.stderr.close()
+
+    def test_stale_socket_is_replaced(self):
+        with tempfile.TemporaryDirectory() as directory:
+            socket_path = os.path.join(directory, "s.sock")
+            stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            stale.bind(socket_path)
+            stale.close()
+            server = self.start_server(socket_path)
+            try:
+                self.assertIn("Listening on", server.stderr.readline())
+            finally:
+                server.terminate()
+                server.wait()
+                server.stderr.close()
+
+
+class WorkerPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.workers = scheduler.WorkerPool(2, 2)
+
+    def tearDown(self):
+        self.workers.close()
+
+    def test_pool_is_replaced_when_a_worker_dies(self):
+        os.kill(self.workers.run(scheduler.warm_up), signal.SIGKILL)
+        request = {"algorithm": "SJF", "processes": [{"number": 1, "start": 0, "states": [["B", 3]]}]}
+        self.assertEqual(self.workers.run(scheduler.simulate_request, request)["schedule"], [["1", 0, 3]])
+
+    def test_simulations_that_time_out_are_stopped(self):
+        worker = self.workers.run(scheduler.warm_up)
+        with self.assertRaises(scheduler.FutureTimeoutError):
+            self.workers.run(time.sleep, 30)
+        self.assertNotEqual(self.workers.run(scheduler.warm_up), worker)
+        with self.assertRaises(OSError):
+            os.kill(worker, 0)
+
+    def test_requests_that_kill_their_worker_are_not_retried(self):
+        pools = []
+        start = self.workers.start
+        self.workers.start = lambda: pools.append(start()) or pools[-1]
+        with self.assertRaises(scheduler.BrokenProcessPool):
+            self.workers.run(os._exit, 1)
+        self.assertEqual(len(pools), 1)
+
+    def test_other_requests_are_retried_when_one_times_out(self):
+        results = []
+
+        def run_other():
+            # Still running when the first request times out
+            time.sleep(1)
+            results.append(self.workers.run(time.sleep, 1.5))
+        other = threading.Thread(target=run_other)
+        other.start()
+        with self.assertRaises(scheduler.FutureTimeoutError):
+            self.workers.run(time.sleep, 30)
+        other.join()
+        self.assertEqual(results, [None])
+
+
+if __name__ == "__main__":
+    unittest.main()